@@ -9,6 +9,9 @@ from email.mime.text import MIMEText
 import uuid
 import os
 import time
+import json
+import threading
+import zipfile
 from dotenv import load_dotenv
 import os
 from werkzeug.utils import secure_filename
@@ -18,6 +21,21 @@ load_dotenv()
 call_data = {}
 calls = {}
 
+# Background account jobs (deletion / data export). The account_jobs table is
+# the source of truth and is shared by every worker process; `jobs` only keeps
+# progress and cancel flags of the jobs this process is running, keyed by job_id.
+jobs = {}
+jobs_lock = threading.Lock()
+JOB_BATCH_SIZE = 500      # rows per transaction, keeps the SQLite write lock short
+JOB_BATCH_PAUSE = 0.01    # pause between batches so request threads can write
+JOB_TTL = 3600            # finished jobs (and their export files) are kept for 1 hour
+JOB_CLEANUP_INTERVAL = 600  # how often expired exports are pruned and failed deletions retried
+JOB_HEARTBEAT = 30        # running jobs refresh account_jobs.updated_at this often
+JOB_STALE = 300           # a running job without a heartbeat for this long is considered dead
+
+class JobCancelled(Exception):
+    pass
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Разрешить все источники для тестирования
 
@@ -28,6 +46,11 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Directory to save data exports
+EXPORT_FOLDER = 'exports'
+if not os.path.exists(EXPORT_FOLDER):
+    os.makedirs(EXPORT_FOLDER)
+
 @app.route('/record/upload', methods=['POST'])
 def upload_recording():
     username = check_auth(request.cookies)
@@ -104,7 +127,42 @@ def init_db():
                       call_id TEXT NOT NULL UNIQUE,
                       status TEXT NOT NULL DEFAULT 'pending',
                       created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS recordings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            call_id TEXT,
+            username TEXT,
+            file_path TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )''')
+        # Индексы для выборок по пользователю (удаление и экспорт аккаунта)
+        c.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages (receiver)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_calls_caller ON calls (caller)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_calls_receiver ON calls (receiver)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_recordings_username ON recordings (username)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_recovery_username ON recovery (username)')
+        # Durable record of background jobs, so unfinished deletions survive a restart
+        c.execute('''CREATE TABLE IF NOT EXISTS account_jobs 
+                     (id TEXT PRIMARY KEY, 
+                      type TEXT NOT NULL,
+                      username TEXT NOT NULL,
+                      status TEXT NOT NULL DEFAULT 'pending',
+                      file_path TEXT,
+                      created_at REAL NOT NULL,
+                      finished_at REAL,
+                      updated_at REAL)''')
+        c.execute("PRAGMA table_info(account_jobs)")
+        columns = [col[1] for col in c.fetchall()]
+        if 'updated_at' not in columns:
+            print("Adding updated_at column to account_jobs table")
+            c.execute("ALTER TABLE account_jobs ADD COLUMN updated_at REAL")
+            c.execute("UPDATE account_jobs SET updated_at = created_at")
+        # Jobs are no longer stored as 'pending'; older rows are picked up as dead running jobs
+        c.execute("UPDATE account_jobs SET status = 'running' WHERE status = 'pending'")
+        c.execute('CREATE INDEX IF NOT EXISTS idx_account_jobs_username ON account_jobs (username, type)')
         conn.commit()
+        # WAL: readers are not blocked while background jobs write (must run outside a transaction)
+        c.execute('PRAGMA journal_mode=WAL').fetchone()
     except Exception as e:
         print(f"Database initialization error: {e}")
     finally:
@@ -336,8 +394,15 @@ def register():
         conn = sqlite3.connect('database.db')
         c = conn.cursor()
         try:
-            c.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)', 
-                      (username, hashed_password, email))
+            # Single statement, so a deletion cannot commit between the check and the insert.
+            # Failed deletions count too: they are retried and would wipe the new account.
+            c.execute('''INSERT INTO users (username, password, email) 
+                         SELECT ?, ?, ? WHERE NOT EXISTS 
+                         (SELECT 1 FROM account_jobs 
+                          WHERE type = 'delete' AND username = ? AND status != 'done')''', 
+                      (username, hashed_password, email, username))
+            if c.rowcount == 0:
+                return jsonify({'error': 'This username is being deleted, please try again later'}), 409
             conn.commit()
             response = make_response(jsonify({'message': 'User registered successfully'}), 201)
             response.set_cookie('username', username, max_age=3600)
@@ -393,23 +458,477 @@ def logout():
 
 @app.route('/deleteacc', methods=['POST'])
 def deleteacc():
-    username = request.cookies.get('username')
+    username = check_auth(request.cookies)
     if not username:
-        return jsonify({'error': 'No username cookie found'}), 400
+        return jsonify({'error': 'Unauthorized'}), 401
+    job = new_job('delete', username)
     try:
+        # The user row goes immediately so the account can no longer log in;
+        # messages, calls, recordings and exports are purged by a background job.
+        # The job row is written in the same transaction, so the deletion is
+        # durable and register() refuses the name from the moment it commits.
         conn = sqlite3.connect('database.db')
         c = conn.cursor()
         c.execute("DELETE FROM users WHERE username = ?", (username,))
-        c.execute("DELETE FROM messages WHERE sender = ? OR receiver = ?", (username, username))
-        c.execute("DELETE FROM recovery WHERE username = ?", (username,))
+        if c.rowcount == 0:
+            conn.rollback()
+            conn.close()
+            return jsonify({'error': 'Account deletion is already in progress'}), 409
+        insert_job(c, job)
+        # Running exports of this account are cancelled only if the deletion commits
+        c.execute("""UPDATE account_jobs SET status = 'cancelled', finished_at = ? 
+                     WHERE type = 'export' AND username = ? AND status = 'running'""",
+                  (time.time(), username))
         conn.commit()
         conn.close()
-        response = make_response(jsonify({'message': f'Account {username} deleted successfully'}), 200)
-        response.delete_cookie('username')
-        return response
     except Exception as e:
         print(f"Delete account error: {e}")
         return jsonify({'error': 'Server error during account deletion'}), 500
+    with jobs_lock:
+        jobs[job['id']] = job
+        for other in jobs.values():
+            if other['type'] == 'export' and other['username'] == username:
+                other['cancelled'] = True
+    start_job_thread(job)
+    response = make_response(jsonify({
+        'message': f'Account {username} deletion started',
+        'job_id': job['id'],
+        'status_url': f"/jobs/{job['id']}"
+    }), 202)
+    response.delete_cookie('username')
+    return response
+
+@app.route('/account/export', methods=['POST'])
+def export_account():
+    username = check_auth(request.cookies)
+    if not username:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        job = new_job('export', username)
+        conn = sqlite3.connect('database.db')
+        c = conn.cursor()
+        c.execute("""INSERT INTO account_jobs 
+                     (id, type, username, status, created_at, updated_at) 
+                     SELECT ?, 'export', ?, 'running', ?, ? WHERE NOT EXISTS 
+                     (SELECT 1 FROM account_jobs 
+                      WHERE type = 'export' AND username = ? AND status = 'running' AND updated_at > ?)""",
+                  (job['id'], username, job['created_at'], job['created_at'],
+                   username, time.time() - JOB_STALE))
+        conn.commit()
+        conn.close()
+        if c.rowcount == 0:
+            return jsonify({'error': 'Export is already in progress'}), 409
+        with jobs_lock:
+            jobs[job['id']] = job
+        start_job_thread(job)
+        return jsonify({
+            'message': 'Data export started',
+            'job_id': job['id'],
+            'status_url': f"/jobs/{job['id']}"
+        }), 202
+    except Exception as e:
+        print(f"Export account error: {e}")
+        return jsonify({'error': 'Server error during data export'}), 500
+
+@app.route('/account/export/<job_id>', methods=['GET'])
+def download_export(job_id):
+    username = check_auth(request.cookies)
+    if not username:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        job = load_job(job_id)
+        if not job or job['type'] != 'export' or job['username'] != username:
+            return jsonify({'error': 'Export not found'}), 404
+        if job['status'] != 'done':
+            return jsonify({'error': 'Export is not ready yet', 'status': job['status']}), 409
+        if not job['file_path'] or not os.path.exists(job['file_path']):
+            return jsonify({'error': 'Export file not found'}), 404
+        return send_file(job['file_path'], mimetype='application/zip', as_attachment=True,
+                         download_name=f"{secure_filename(username)}_export.zip")
+    except Exception as e:
+        print(f"Download export error: {e}")
+        return jsonify({'error': 'Server error during export download'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    try:
+        job = load_job(job_id)
+    except Exception as e:
+        print(f"Job status error: {e}")
+        return jsonify({'error': 'Server error while fetching job status'}), 500
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    # Deletion jobs outlive the session cookie, so the job_id alone grants access;
+    # export status is only visible to the owner.
+    if job['type'] == 'export' and check_auth(request.cookies) != job['username']:
+        return jsonify({'error': 'Job not found'}), 404
+    result = {
+        'job_id': job['id'],
+        'type': job['type'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'processed': sum(job['progress'].values()),
+        'total': job['total'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error']
+    }
+    if job['type'] == 'export' and job['status'] == 'done':
+        result['download_url'] = f"/account/export/{job['id']}"
+    return jsonify(result), 200
+
+def new_job(job_type, username, job_id=None, created_at=None):
+    now = time.time()
+    return {
+        'id': job_id or str(uuid.uuid4()),
+        'type': job_type,
+        'username': username,
+        'status': 'running',
+        'progress': {},
+        'total': None,
+        'created_at': created_at or now,
+        'finished_at': None,
+        'error': None,
+        'file_path': None,
+        'cancelled': False,
+        'touched_at': now
+    }
+
+def insert_job(c, job):
+    c.execute('INSERT INTO account_jobs '
+              '(id, type, username, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+              (job['id'], job['type'], job['username'], job['status'],
+               job['created_at'], job['touched_at']))
+
+def load_job(job_id):
+    # The row may belong to another worker; progress is only known to the one running it
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute('SELECT id, type, username, status, file_path, created_at, finished_at '
+              'FROM account_jobs WHERE id = ?', (job_id,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None
+    job = dict(zip(['id', 'type', 'username', 'status', 'file_path', 'created_at', 'finished_at'], row))
+    with jobs_lock:
+        local = jobs.get(job_id)
+        job['progress'] = dict(local['progress']) if local else {}
+        job['total'] = local['total'] if local else None
+        job['error'] = local['error'] if local else None
+    return job
+
+def start_job_thread(job):
+    target = run_delete_job if job['type'] == 'delete' else run_export_job
+    threading.Thread(target=run_job, args=(job, target), daemon=True).start()
+
+def run_job(job, target):
+    try:
+        target(job)
+        update_job(job, status='done', finished_at=time.time())
+    except JobCancelled:
+        update_job(job, status='cancelled', finished_at=time.time())
+    except Exception as e:
+        print(f"Job {job['id']} ({job['type']}) error: {e}")
+        update_job(job, status='failed', error=str(e), finished_at=time.time())
+    try:
+        with jobs_lock:
+            snapshot = dict(job)
+        conn = sqlite3.connect('database.db')
+        # UPDATE, not INSERT: a row removed by a deletion must stay removed.
+        # A row already marked 'cancelled' by /deleteacc keeps that status.
+        conn.execute("""UPDATE account_jobs SET status = ?, file_path = ?, finished_at = ?, updated_at = ? 
+                        WHERE id = ? AND status = 'running'""",
+                     (snapshot['status'], snapshot['file_path'], snapshot['finished_at'],
+                      time.time(), snapshot['id']))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Save job {job['id']} error: {e}")
+
+def update_job(job, **fields):
+    with jobs_lock:
+        job.update(fields)
+
+def add_job_progress(job, key, count):
+    with jobs_lock:
+        job['progress'][key] = job['progress'].get(key, 0) + count
+
+def touch_job(conn, job):
+    # Heartbeat, so other workers can tell this job apart from one whose process died
+    now = time.time()
+    if now - job['touched_at'] < JOB_HEARTBEAT:
+        return
+    conn.execute('UPDATE account_jobs SET updated_at = ? WHERE id = ?', (now, job['id']))
+    conn.commit()
+    job['touched_at'] = now
+
+def check_cancelled(conn, job):
+    if job['cancelled']:
+        raise JobCancelled()
+    c = conn.cursor()
+    c.execute('SELECT status FROM account_jobs WHERE id = ?', (job['id'],))
+    row = c.fetchone()
+    if not row or row[0] != 'running':
+        raise JobCancelled()
+
+def resume_deletions():
+    # Claims failed deletions and running ones whose worker died. The claim is a
+    # single UPDATE, so only one worker picks each job up; jobs still being set up
+    # by /deleteacc are never seen here because they only exist once committed.
+    now = time.time()
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("""SELECT id, username, created_at FROM account_jobs 
+                 WHERE type = 'delete' 
+                 AND (status = 'failed' OR (status = 'running' AND updated_at < ?))""",
+              (now - JOB_STALE,))
+    claimed = []
+    for job_id, username, created_at in c.fetchall():
+        c.execute("""UPDATE account_jobs SET status = 'running', finished_at = NULL, updated_at = ? 
+                     WHERE id = ? 
+                     AND (status = 'failed' OR (status = 'running' AND updated_at < ?))""",
+                  (now, job_id, now - JOB_STALE))
+        conn.commit()
+        if c.rowcount == 1:
+            claimed.append(new_job('delete', username, job_id, created_at))
+    conn.close()
+    for job in claimed:
+        with jobs_lock:
+            jobs[job['id']] = job
+        start_job_thread(job)
+
+def prune_jobs():
+    now = time.time()
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    # Exports whose worker died will never finish
+    c.execute("""UPDATE account_jobs SET status = 'failed', finished_at = ? 
+                 WHERE type = 'export' AND status = 'running' AND updated_at < ?""",
+              (now, now - JOB_STALE))
+    conn.commit()
+    # Failed deletions are kept so that resume_deletions() retries them
+    c.execute("""SELECT id, file_path FROM account_jobs 
+                 WHERE finished_at < ? AND NOT (type = 'delete' AND status != 'done')""",
+              (now - JOB_TTL,))
+    expired = c.fetchall()
+    c.executemany('DELETE FROM account_jobs WHERE id = ?', [(row[0],) for row in expired])
+    conn.commit()
+    conn.close()
+    with jobs_lock:
+        for job_id, _ in expired:
+            jobs.pop(job_id, None)
+    for _, file_path in expired:
+        remove_file(file_path)
+    sweep_exports()
+
+def sweep_exports():
+    # Remove export files (including partial .tmp ones) that no running or
+    # finished export owns. Checked against account_jobs, so files of jobs
+    # run by other workers are left alone.
+    conn = sqlite3.connect('database.db')
+    c = conn.cursor()
+    c.execute("SELECT id FROM account_jobs WHERE type = 'export' AND status IN ('running', 'done')")
+    known = {row[0] for row in c.fetchall()}
+    conn.close()
+    for name in os.listdir(EXPORT_FOLDER):
+        job_id = name.split('.', 1)[0][len('export_'):]
+        if not name.startswith('export_') or job_id not in known:
+            remove_file(os.path.join(EXPORT_FOLDER, name))
+
+def recover_jobs():
+    # Called on startup: clean up after the previous run and pick up deletions it left behind
+    prune_jobs()
+    resume_deletions()
+
+def cleanup_jobs_loop():
+    while True:
+        time.sleep(JOB_CLEANUP_INTERVAL)
+        try:
+            prune_jobs()
+            resume_deletions()
+        except Exception as e:
+            print(f"Job cleanup error: {e}")
+
+def remove_file(file_path):
+    if not file_path:
+        return
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    except OSError as e:
+        print(f"Remove file error: {e}")
+
+def count_user_rows(c, username):
+    c.execute('SELECT COUNT(*) FROM messages WHERE sender = ?', (username,))
+    total = c.fetchone()[0]
+    c.execute('SELECT COUNT(*) FROM messages WHERE receiver = ? AND sender != ?', (username, username))
+    total += c.fetchone()[0]
+    c.execute('SELECT COUNT(*) FROM calls WHERE caller = ?', (username,))
+    total += c.fetchone()[0]
+    c.execute('SELECT COUNT(*) FROM calls WHERE receiver = ? AND caller != ?', (username, username))
+    total += c.fetchone()[0]
+    c.execute('SELECT COUNT(*) FROM recordings WHERE username = ?', (username,))
+    total += c.fetchone()[0]
+    return total
+
+def delete_in_batches(job, conn, table, column, username):
+    c = conn.cursor()
+    while True:
+        c.execute(f'DELETE FROM {table} WHERE id IN '
+                  f'(SELECT id FROM {table} WHERE {column} = ? LIMIT ?)',
+                  (username, JOB_BATCH_SIZE))
+        deleted = c.rowcount
+        conn.commit()
+        add_job_progress(job, table, deleted)
+        touch_job(conn, job)
+        if deleted < JOB_BATCH_SIZE:
+            return
+        time.sleep(JOB_BATCH_PAUSE)
+
+def delete_recordings_in_batches(job, conn, username):
+    c = conn.cursor()
+    while True:
+        c.execute('SELECT id, file_path FROM recordings WHERE username = ? LIMIT ?',
+                  (username, JOB_BATCH_SIZE))
+        rows = c.fetchall()
+        if not rows:
+            return
+        for _, file_path in rows:
+            remove_file(file_path)
+        c.executemany('DELETE FROM recordings WHERE id = ?', [(row[0],) for row in rows])
+        conn.commit()
+        add_job_progress(job, 'recordings', len(rows))
+        touch_job(conn, job)
+        if len(rows) < JOB_BATCH_SIZE:
+            return
+        time.sleep(JOB_BATCH_PAUSE)
+
+def run_delete_job(job):
+    username = job['username']
+    conn = sqlite3.connect('database.db')
+    try:
+        update_job(job, total=count_user_rows(conn.cursor(), username))
+        delete_in_batches(job, conn, 'messages', 'sender', username)
+        delete_in_batches(job, conn, 'messages', 'receiver', username)
+        delete_in_batches(job, conn, 'calls', 'caller', username)
+        delete_in_batches(job, conn, 'calls', 'receiver', username)
+        delete_recordings_in_batches(job, conn, username)
+        conn.execute('DELETE FROM recovery WHERE username = ?', (username,))
+        conn.commit()
+        # /deleteacc cancelled this account's exports. Wait for the ones running
+        # here to stop, then drop every export file and row of the account;
+        # run_export_job never publishes once the deletion row exists.
+        while True:
+            with jobs_lock:
+                running = any(other['type'] == 'export' and other['username'] == username
+                              and other['status'] == 'running' for other in jobs.values())
+            if not running:
+                break
+            time.sleep(JOB_BATCH_PAUSE)
+        c = conn.cursor()
+        c.execute("SELECT id, file_path FROM account_jobs WHERE type = 'export' AND username = ?",
+                  (username,))
+        exports = c.fetchall()
+        for export_id, file_path in exports:
+            remove_file(file_path)
+            remove_file(os.path.join(EXPORT_FOLDER, f"export_{export_id}.zip.tmp"))
+        c.executemany('DELETE FROM account_jobs WHERE id = ?', [(row[0],) for row in exports])
+        conn.commit()
+        with jobs_lock:
+            for export_id, _ in exports:
+                jobs.pop(export_id, None)
+    finally:
+        conn.close()
+
+def iter_rows_in_batches(job, conn, query, params):
+    # Keyset pagination on id: every batch is a short indexed range scan
+    c = conn.cursor()
+    last_id = 0
+    while True:
+        check_cancelled(conn, job)
+        touch_job(conn, job)
+        c.execute(query, params + (last_id, JOB_BATCH_SIZE))
+        rows = c.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+        if len(rows) < JOB_BATCH_SIZE:
+            return
+        time.sleep(JOB_BATCH_PAUSE)
+
+def write_ndjson(job, conn, zf, name, key, columns, queries):
+    with zf.open(name, 'w') as f:
+        for query, params in queries:
+            for rows in iter_rows_in_batches(job, conn, query, params):
+                for row in rows:
+                    f.write((json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n').encode('utf-8'))
+                add_job_progress(job, key, len(rows))
+
+def run_export_job(job):
+    username = job['username']
+    file_path = os.path.join(EXPORT_FOLDER, f"export_{job['id']}.zip")
+    tmp_path = file_path + '.tmp'
+    conn = sqlite3.connect('database.db')
+    try:
+        c = conn.cursor()
+        update_job(job, total=count_user_rows(c, username))
+        c.execute('SELECT username, email FROM users WHERE username = ?', (username,))
+        user = c.fetchone()
+        if not user:
+            raise ValueError('User not found')
+        message_columns = ['id', 'sender', 'receiver', 'message', 'is_system', 'timestamp']
+        call_columns = ['id', 'caller', 'receiver', 'call_id', 'status', 'created_at']
+        recording_columns = ['id', 'call_id', 'username', 'file_path', 'timestamp']
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('profile.json', json.dumps({'username': user[0], 'email': user[1]},
+                                                   ensure_ascii=False, indent=2))
+            write_ndjson(job, conn, zf, 'messages.ndjson', 'messages', message_columns, [
+                ('SELECT id, sender, receiver, message, is_system, timestamp FROM messages '
+                 'WHERE sender = ? AND id > ? ORDER BY id LIMIT ?', (username,)),
+                ('SELECT id, sender, receiver, message, is_system, timestamp FROM messages '
+                 'WHERE receiver = ? AND sender != ? AND id > ? ORDER BY id LIMIT ?', (username, username)),
+            ])
+            write_ndjson(job, conn, zf, 'calls.ndjson', 'calls', call_columns, [
+                ('SELECT id, caller, receiver, call_id, status, created_at FROM calls '
+                 'WHERE caller = ? AND id > ? ORDER BY id LIMIT ?', (username,)),
+                ('SELECT id, caller, receiver, call_id, status, created_at FROM calls '
+                 'WHERE receiver = ? AND caller != ? AND id > ? ORDER BY id LIMIT ?', (username, username)),
+            ])
+            write_ndjson(job, conn, zf, 'recordings.ndjson', 'recordings', recording_columns, [
+                ('SELECT id, call_id, username, file_path, timestamp FROM recordings '
+                 'WHERE username = ? AND id > ? ORDER BY id LIMIT ?', (username,)),
+            ])
+            # ZipFile.write copies each file in chunks, recordings are never held in memory
+            for rows in iter_rows_in_batches(job, conn, 'SELECT id, file_path FROM recordings '
+                                             'WHERE username = ? AND id > ? ORDER BY id LIMIT ?',
+                                             (username,)):
+                for _, recording_path in rows:
+                    if recording_path and os.path.exists(recording_path):
+                        zf.write(recording_path, arcname=f"recordings/{os.path.basename(recording_path)}")
+        # Publish inside a write transaction: /deleteacc writes its job row in one
+        # too, so a deletion either makes this export discard its file or commits
+        # after file_path is recorded and removes it.
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        c.execute('SELECT status FROM account_jobs WHERE id = ?', (job['id'],))
+        row = c.fetchone()
+        c.execute("SELECT 1 FROM account_jobs WHERE type = 'delete' AND username = ? AND status != 'done'",
+                  (username,))
+        if job['cancelled'] or not row or row[0] != 'running' or c.fetchone():
+            conn.rollback()
+            raise JobCancelled()
+        os.replace(tmp_path, file_path)
+        c.execute("UPDATE account_jobs SET status = 'done', file_path = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                  (file_path, time.time(), time.time(), job['id']))
+        conn.commit()
+        update_job(job, file_path=file_path)
+    except Exception:
+        remove_file(tmp_path)
+        raise
+    finally:
+        conn.close()
 
 @app.route('/users', methods=['GET'])
 def get_users():
@@ -661,3 +1180,5 @@ def download_recording(filename):
         return jsonify({'error': 'Server error during file download'}), 500
 
 init_db()
+recover_jobs()
+threading.Thread(target=cleanup_jobs_loop, daemon=True).start()